@@ -1,45 +1,118 @@
-from dotenv import load_dotenv
-load_dotenv()
-
 #Step1: Setup GROQ API key
 import os
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+from config import CFG
 
 #Step2: Convert image to required format
-import base64
+import io
+import mmap
+from functools import lru_cache
+import pybase64
+from PIL import Image, ImageOps
+
+# bigger images are downscaled (base64 and upload time grow with the pixels)
+MAX_IMAGE_BYTES = 1024 * 1024
+MAX_IMAGE_PIXELS = 2048 * 2048
+DOWNSCALED_IMAGE_SIZE = (1536, 1536)
+
+def sniff_image_mime(header):
+    """MIME type from the file's magic bytes, for the formats the model accepts as-is."""
+    if header.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG"):
+        return "image/png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def downscale_image(img):
+    # the JPEG is saved without EXIF, so apply the orientation tag to the pixels first
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail(DOWNSCALED_IMAGE_SIZE, Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, format="JPEG", quality=85)
+    return buf.getbuffer()
 
-def encode_image(image_path):   
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+def encode_image(image_path):
+    """
+    Return the image as a ready-to-send data URI (see _encode_image_cached).
+    Resubmitting the same, unchanged file is served from the cache.
+    """
+    st = os.stat(image_path)
+    return _encode_image_cached(image_path, st.st_mtime_ns, st.st_size)
+
+# mtime and size are part of the key so an edited file is encoded again
+@lru_cache(maxsize=32)
+def _encode_image_cached(image_path, mtime_ns, size):
+    """
+    Return the image as a ready-to-send data URI with its real MIME type. The
+    file is memory-mapped and handed to pybase64's SIMD encoder, which returns
+    the str directly. Large or unsupported images are re-encoded as a smaller
+    JPEG first.
+    """
+    with open(image_path, "rb") as image_file, \
+            mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        mime = sniff_image_mime(mapped[:12])
+        payload = mapped
+        with Image.open(image_path) as img:  # lazy: only the header is read here
+            if mime is None or len(mapped) > MAX_IMAGE_BYTES or img.width * img.height > MAX_IMAGE_PIXELS:
+                mime, payload = "image/jpeg", downscale_image(img)
+        return f"data:{mime};base64," + pybase64.b64encode_as_string(payload)
 
 #Step3: Setup Multimodal LLM 
-from groq import Groq
+import httpx
+from groq import Groq, DefaultHttpxClient, BadRequestError, NOT_GIVEN
+
+# one client for the whole process so its connection pool (and TLS sessions) is reused;
+# with HTTP/2 the STT and chat calls are multiplexed over a single connection
+GROQ_CLIENT = Groq(
+    api_key=CFG.groq_key,
+    http_client=DefaultHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=60)
+    )
+)
 
 query="Is there something wrong with my face?"
-model="meta-llama/llama-4-scout-17b-16e-instruct"
+model=CFG.model
 
-def analyze_image_with_query(query, model, encoded_image):
-    client = Groq(api_key=GROQ_API_KEY)   # FIXED HERE
+def analyze_image_with_query(query, model, encoded_image, response_format=None):
+    """
+    Return the model's text reply. Pass response_format={"type": "json_object"}
+    to get guaranteed valid JSON; if Groq rejects the generation as invalid
+    JSON, the failed text is returned so the caller can fall back on it.
+    """
+    # the image part is only attached when there is an image, so a text-only
+    # question is still one well-formed request
+    content = [{"type": "text", "text": query}]
+    if encoded_image is not None:
+        content.append(
+            {"type": "image_url",
+             "image_url": {
+                 "url": encoded_image,
+             },
+            }
+        )
     messages = [
         {
             "role": "user",
-            "content": [
-                {"type": "text", "text": query},
-                {"type": "image_url",
-                 "image_url": {
-                     "url": f"data:image/jpeg;base64,{encoded_image}",
-                 },
-                },
-            ],
+            "content": content,
         }
     ]
 
-    chat_completion = client.chat.completions.create(
-        messages=messages,
-        model=model
-    )
+    try:
+        chat_completion = GROQ_CLIENT.chat.completions.create(
+            messages=messages,
+            model=model,
+            response_format=NOT_GIVEN if response_format is None else response_format
+        )
+    except BadRequestError as e:
+        # invalid JSON comes back as an API error, the model's text is kept in it
+        error = e.body.get("error", {}) if isinstance(e.body, dict) else {}
+        if response_format is None or error.get("code") != "json_validate_failed":
+            raise
+        return error.get("failed_generation") or ""
 
-    return chat_completion.choices[0].message.content
+    return chat_completion.choices[0].message.content or ""
 
 # MAIN EXECUTION
 if __name__ == "__main__":
@@ -0,0 +1,20 @@
+# config.py
+# The one place that reads the environment (and the .env file); the other modules import CFG.
+import os
+from dataclasses import dataclass
+from typing import Final
+from dotenv import load_dotenv
+
+load_dotenv()
+
+@dataclass(frozen=True, slots=True)
+class Cfg:
+    groq_key: str
+    model: str
+    stt_model: str
+
+CFG: Final = Cfg(
+    groq_key=os.environ["GROQ_API_KEY"],
+    model="meta-llama/llama-4-scout-17b-16e-instruct",
+    stt_model="whisper-large-v3",
+)
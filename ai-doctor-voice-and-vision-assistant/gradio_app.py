@@ -1,19 +1,27 @@
 # gradio_app.py
-# if you dont use pipenv uncomment the following:
-# from dotenv import load_dotenv
-# load_dotenv()
 
-import os
+import io
+import re
 import json
+import wave
+import asyncio
+import logging
+import threading
+import orjson
+import numpy as np
 import gradio as gr
-from pathlib import Path
-from brain_of_the_doctor import encode_image, analyze_image_with_query
-from voice_of_the_patient import transcribe_with_groq
+from scipy.signal import resample_poly
+from config import CFG
+from brain_of_the_doctor import GROQ_CLIENT, encode_image, analyze_image_with_query
+from voice_of_the_patient import transcribe_words_with_groq
 from voice_of_the_doctor import text_to_speech_with_gtts
 
 # --- Configuration ---
-MODEL_NAME = "meta-llama/llama-4-scout-17b-16e-instruct"  # your choice A
-GROQ_KEY = os.environ.get("GROQ_API_KEY")
+# model names and the Groq key come from config.CFG
+STT_SAMPLE_RATE = 16000
+STREAM_MAX_SECONDS = 30  # Whisper's trained context; older unconfirmed audio is dropped
+LLM_CONCURRENCY = 16  # handlers allowed to run at once (they are network-bound)
+QUEUE_MAX_SIZE = 64
 
 # System prompt tuned for Format 2 + JSON output (analysis short, treatment longer)
 SYSTEM_PROMPT_TEMPLATE = """
@@ -28,69 +36,201 @@ Rules:
 
 If the image is missing or unclear, set "analysis" to "Image not provided or unclear" and give a general short treatment in "treatment".
 """
+PROMPT_HEAD = SYSTEM_PROMPT_TEMPLATE + "\n\n"
 
 # --- Helpers ---
 def safe_parse_json(model_text: str):
     """
-    Try to parse model_text as JSON. If it fails, do a best-effort extraction:
-    look for the first {...} block and parse that. If still fails, return
-    fallback values.
+    Parse the model's JSON reply. JSON mode makes it valid JSON, except when
+    Groq rejects the generation and its failed text is passed on instead; then
+    return fallback values.
     """
-    # direct parse
     try:
-        return json.loads(model_text)
-    except Exception:
-        pass
-
-    # try to find first JSON object in text
-    start = model_text.find("{")
-    end = model_text.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        try:
-            candidate = model_text[start:end+1]
-            return json.loads(candidate)
-        except Exception:
-            pass
-
-    # fallback: return the whole text in treatment and a generic analysis
-    return {
-        "analysis": "Could not parse structured analysis from the model output.",
-        "treatment": model_text.strip()[:2000]  # keep the raw text as treatment fallback
-    }
+        return orjson.loads(model_text)
+    except orjson.JSONDecodeError:
+        # fallback: return the whole text in treatment and a generic analysis
+        return {
+            "analysis": "Could not parse structured analysis from the model output.",
+            "treatment": model_text.strip()
+        }
 
-# --- Core processing function ---
-def process_inputs(audio_filepath, image_filepath):
-    # 1) STT (optional)
-    stt_text = ""
+def warmup_groq():
+    """
+    Send a 1-token completion and a short silent transcription so the first
+    patient doesn't pay for DNS, the TLS handshake and the model cold start.
+    """
     try:
-        if audio_filepath:
-            stt_text = transcribe_with_groq(GROQ_API_KEY=GROQ_KEY, audio_filepath=audio_filepath, stt_model="whisper-large-v3") or ""
-        else:
-            stt_text = ""
+        GROQ_CLIENT.chat.completions.create(
+            model=CFG.model,
+            messages=[{"role": "user", "content": "hi"}],
+            max_tokens=1
+        )
+        silence = np.zeros(STT_SAMPLE_RATE // 2, dtype=np.int16)  # 0.5 s
+        GROQ_CLIENT.audio.transcriptions.create(
+            model=CFG.stt_model,
+            file=("warmup.wav", wav_bytes(STT_SAMPLE_RATE, silence)),
+            language="en"
+        )
     except Exception as e:
-        stt_text = f"[STT error: {str(e)}]"
+        logging.warning(f"Groq warmup failed: {e}")
 
-    # 2) Build prompt for LLM
-    assembled_prompt = SYSTEM_PROMPT_TEMPLATE + "\n\n"
-    if stt_text:
-        assembled_prompt += "Patient speech (transcription): " + stt_text + "\n\n"
+# --- Live transcription while the patient records ---
+# Every streamed chunk re-transcribes the unconfirmed audio window. A word is only
+# confirmed once two consecutive transcriptions agree on it (LocalAgreement-2);
+# confirmed words are committed and their audio is trimmed from the window.
+def new_stream_state():
+    # hypothesis: the (word, end time) pairs of the last pass that are not confirmed yet;
+    # busy: held while a transcription for this session runs, so the final pass can wait for it;
+    # replaced: a new recording or Clear made a fresh state, so passes still running on this one are stale
+    # audio: the window at the recording's own rate, resampled for Whisper once per upload
+    return {"audio": np.zeros(0, dtype=np.int16), "sample_rate": STT_SAMPLE_RATE, "committed": [], "hypothesis": [],
+            "busy": asyncio.Lock(), "replaced": False}
 
-    if image_filepath:
-        # encode image and pass it to your analyze function which should send image + prompt to the model
+def replace_stream_state(state):
+    """Fresh state for a new recording; live passes still running on the old one stop writing."""
+    if state is not None:
+        state["replaced"] = True
+    return new_stream_state()
+
+def to_stt_pcm(sample_rate, samples, resample=True):
+    """
+    Downmix to mono, resample to 16 kHz and quantize to int16 PCM: Whisper
+    needs nothing more, and it is a fraction of the bytes of 48 kHz float audio.
+    With resample=False the rate is kept, for streamed chunks: resampling each
+    chunk on its own pads its edges and clicks at every chunk boundary.
+    """
+    resample = resample and sample_rate != STT_SAMPLE_RATE
+    if samples.ndim == 1 and samples.dtype == np.int16 and not resample:
+        return samples
+    # whole-array float32 ops (SIMD in NumPy), done in place after the first copy
+    scale = 1.0 / np.iinfo(samples.dtype).max if np.issubdtype(samples.dtype, np.integer) else 1.0
+    samples = samples.astype(np.float32)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1, dtype=np.float32)
+    if resample:
+        samples = resample_poly(samples, STT_SAMPLE_RATE, sample_rate)
+    samples *= scale * 32767
+    np.clip(samples, -32768, 32767, out=samples)
+    return samples.astype(np.int16)
+
+def wav_bytes(sample_rate, samples):
+    """Mono 16-bit WAV built in memory, ready to upload without touching the disk."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+def transcribe_window(audio, sample_rate, committed):
+    """Transcribe an audio window, prompted with the committed text."""
+    pcm = to_stt_pcm(sample_rate, audio)
+    return transcribe_words_with_groq(
+        stt_model=CFG.stt_model, audio_file=("audio.wav", wav_bytes(STT_SAMPLE_RATE, pcm)),
+        prompt=" ".join(committed[-50:]) or None, client=GROQ_CLIENT)
+
+def normalize_word(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+def agreed_prefix_length(previous, current):
+    """Number of leading words two consecutive transcriptions agree on."""
+    n = 0
+    for (prev_word, _), (word, _) in zip(previous, current):
+        if normalize_word(prev_word) != normalize_word(word):
+            break
+        n += 1
+    return n
+
+async def on_audio_chunk(chunk, state):
+    if chunk is None or state is None or state["replaced"]:
+        return gr.update()
+    sample_rate, samples = chunk
+    # .stream runs the handler for every chunk, concurrently, on this same dict (changed in
+    # place, never returned): a chunk that arrives while a transcription is in flight only
+    # adds its audio to the window
+    state["sample_rate"] = sample_rate  # the same for every chunk of a recording
+    state["audio"] = np.concatenate([state["audio"], to_stt_pcm(sample_rate, samples, resample=False)])
+    if state["busy"].locked():
+        return gr.update()
+    async with state["busy"]:
+        rate = state["sample_rate"]
+        overflow = len(state["audio"]) - STREAM_MAX_SECONDS * rate
+        if overflow > 0:
+            # the head is dropped: commit the hypothesis words spoken in it (they can't be
+            # heard again) and shift the rest so they stay relative to the window start
+            cut = overflow / rate
+            spoken = [word for word, end in state["hypothesis"] if end <= cut]
+            state["committed"] += spoken
+            state["hypothesis"] = [(word, end - cut) for word, end in state["hypothesis"][len(spoken):]]
+            state["audio"] = state["audio"][overflow:]
+
+        # only appends happen meanwhile, so the window start stays where it is now
         try:
-            encoded = encode_image(image_filepath)
-            model_raw_output = analyze_image_with_query(query=assembled_prompt, encoded_image=encoded, model=MODEL_NAME)
+            words = await asyncio.to_thread(transcribe_window, state["audio"], rate, state["committed"])
         except Exception as e:
+            logging.warning(f"Live STT failed: {e}")
+            return gr.update()
+        if state["replaced"]:
+            return gr.update()
+
+        confirmed = agreed_prefix_length(state["hypothesis"], words)
+        if confirmed:
+            state["committed"] += [word for word, _ in words[:confirmed]]
+            state["audio"] = state["audio"][int(words[confirmed - 1][1] * rate):]
+            state["hypothesis"] = [(word, end - words[confirmed - 1][1]) for word, end in words[confirmed:]]
+        else:
+            state["hypothesis"] = words
+        return " ".join(state["committed"])
+
+async def finish_transcription(state):
+    """Committed words plus one last pass over the audio that is still unconfirmed."""
+    if not state:
+        return ""
+    # a live pass may still be running (Submit right after Stop): let it commit and trim
+    # first, or the final pass would transcribe words it is about to commit again
+    async with state["busy"]:
+        tail = []
+        if len(state["audio"]):
+            try:
+                tail = await asyncio.to_thread(
+                    transcribe_window, state["audio"], state["sample_rate"], state["committed"])
+            except Exception as e:
+                if not state["committed"]:
+                    return f"[STT error: {str(e)}]"
+                logging.warning(f"Final STT pass failed, using the live transcript: {e}")
+        return " ".join(state["committed"] + [word for word, _ in tail])
+
+# --- Core processing function ---
+async def process_inputs(stream_state, image_filepath):
+    # 1) STT (optional; mostly done live while recording) and image encoding run concurrently
+    encode_task = asyncio.to_thread(encode_image, image_filepath) if image_filepath else asyncio.sleep(0)
+    stt_text, encoded = await asyncio.gather(finish_transcription(stream_state), encode_task, return_exceptions=True)
+
+    # 2) Build prompt for LLM (collect the parts, join once)
+    prompt_parts = [PROMPT_HEAD]
+    if stt_text:
+        prompt_parts.append(f"Patient speech (transcription): {stt_text}\n\n")
+
+    if not image_filepath:
+        # If no image, instruct the model accordingly
+        prompt_parts.append("No image provided.")
+    assembled_prompt = "".join(prompt_parts)
+    # one request for both cases: the image is attached only when it was encoded
+    try:
+        if isinstance(encoded, Exception):
+            raise encoded
+        # JSON mode guarantees parseable output; Groq doesn't stream it, so speech starts after parsing
+        model_raw_output = await asyncio.to_thread(
+            analyze_image_with_query, query=assembled_prompt, encoded_image=encoded,
+            model=CFG.model, response_format={"type": "json_object"})
+    except Exception as e:
+        if image_filepath:
             model_raw_output = json.dumps({
                 "analysis": "Image processing error",
                 "treatment": f"Failed to analyze image due to error: {str(e)}"
             })
-    else:
-        # If no image, instruct the model accordingly
-        assembled_prompt += "No image provided."
-        try:
-            model_raw_output = analyze_image_with_query(query=assembled_prompt, encoded_image=None, model=MODEL_NAME)
-        except Exception as e:
+        else:
             model_raw_output = json.dumps({
                 "analysis": "Image not provided or unclear",
                 "treatment": f"No image was provided. If you can, please upload a clear photo. Error detail: {str(e)}"
@@ -103,22 +243,24 @@ def process_inputs(audio_filepath, image_filepath):
     analysis = parsed.get("analysis", "Analysis not available.")
     treatment = parsed.get("treatment", "Treatment not available.")
 
-    # 4) Generate TTS audio for the doctor's combined response (you can choose what text to read out)
-    # we'll speak a short combined voice output: analysis + treatment summary
+    # show the text right away, the voice follows once it is synthesized
+    yield stt_text, analysis, treatment, None
+
+    # 4) TTS for the doctor's combined response (analysis + treatment)
     tts_text = f"{analysis} {treatment}"
-    tts_path = "final.mp3"
     try:
-        # ensure previous file removed to avoid conflicts
-        if Path(tts_path).exists():
-            Path(tts_path).unlink()
-        text_to_speech_with_gtts(input_text=tts_text, output_filepath=tts_path)
+        audio_fp = io.BytesIO()
+        await asyncio.to_thread(text_to_speech_with_gtts, input_text=tts_text, output_fp=audio_fp)
+        tts_audio = audio_fp.getvalue()
     except Exception as e:
         # if TTS fails, keep audio empty and append error to treatment
-        tts_path = None
+        tts_audio = None
         treatment = f"{treatment}\n\n[TTS generation failed: {str(e)}]"
 
-    # 5) Return values in the order: Speech-to-text, analysis, treatment, audio filepath (or None)
-    return stt_text, analysis, treatment, tts_path
+    # 5) Yield values in the order: Speech-to-text, analysis, treatment, mp3 bytes (or None).
+    # Gradio still writes the bytes to its cache (one file per content hash), but each
+    # request gets its own file instead of every user overwriting a shared final.mp3.
+    yield stt_text, analysis, treatment, tts_audio
 
 # --- Build Enhanced UI with gradio Blocks ---
 css = """
@@ -142,7 +284,8 @@ with gr.Blocks(css=css, title="AI response with Vision and Voice (Medical)") as
         with gr.Column(scale=6):
           with gr.Group(elem_id="left_group", visible=True):
                 gr.Markdown("#### Patient Input", elem_classes="label-quiet")
-                audio_in = gr.Audio(sources=["microphone"], type="filepath", label="Record Voice (click to start/stop)")
+                audio_in = gr.Audio(sources=["microphone"], type="numpy", streaming=True, label="Record Voice (click to start/stop)")
+                stream_state = gr.State(None)
                 image_in = gr.Image(type="filepath", label="Upload Medical Image (optional)")
                 with gr.Row():
                     submit_btn = gr.Button("Submit", variant="primary")
@@ -162,18 +305,28 @@ with gr.Blocks(css=css, title="AI response with Vision and Voice (Medical)") as
                 status = gr.Label(value="", visible=False)
 
     # Action wiring
-    def on_submit(audio, image):
+    async def on_submit(stream, image):
         # UI feedback while processing
         status_msg = "Processing... this may take a few seconds"
-        return gr.update(value=status_msg), *process_inputs(audio, image)
+        async for outputs in process_inputs(stream, image):
+            yield gr.update(value=status_msg), *outputs
+
+    # Transcribe live while recording; a new recording starts a fresh transcript.
+    # The state is created here, not by the first chunk: .stream handlers overlap and
+    # Gradio only stores State when one returns, so they must all get this same dict.
+    # It is not a .stream output either, or a late pass would write the old dict back
+    audio_in.start_recording(lambda state: (replace_stream_state(state), ""), inputs=[stream_state], outputs=[stream_state, stt_out])
+    audio_in.stream(fn=on_audio_chunk, inputs=[audio_in, stream_state], outputs=[stt_out], stream_every=1.0)
 
-    # When user clicks Submit -> call process_inputs and update outputs
-    submit_btn.click(fn=process_inputs, inputs=[audio_in, image_in], outputs=[stt_out, analysis_out, treatment_out, audio_out])
+    # When user clicks Submit -> call process_inputs and update outputs.
+    # The handler mostly waits on Groq, so let many patients' requests run side by side.
+    submit_btn.click(fn=process_inputs, inputs=[stream_state, image_in], outputs=[stt_out, analysis_out, treatment_out, audio_out],
+                     api_name=False, queue=True, concurrency_limit=LLM_CONCURRENCY, concurrency_id="llm")
 
     # Clear button resets inputs & outputs
     def clear_all():
         return None, None, None, None, None
-    clear_btn.click(lambda: (None, None, "", "", "", None), inputs=None, outputs=[audio_in, image_in, stt_out, analysis_out, treatment_out, audio_out])
+    clear_btn.click(lambda state: (None, replace_stream_state(state), None, "", "", "", None), inputs=[stream_state], outputs=[audio_in, stream_state, image_in, stt_out, analysis_out, treatment_out, audio_out])
 
     # Optional: flag button to capture attention (no-op here, replace with logging)
     def flag_action(analysis_text, treatment_text):
@@ -181,5 +334,7 @@ with gr.Blocks(css=css, title="AI response with Vision and Voice (Medical)") as
         return gr.update(value="Flagged — thanks. We'll review this case."), 
     flag_btn.click(flag_action, inputs=[analysis_out, treatment_out], outputs=[status])
 
-    # Launch
+    # Launch (warm up the Groq connection in the background meanwhile)
+    threading.Thread(target=warmup_groq, daemon=True).start()
+    demo.queue(default_concurrency_limit=LLM_CONCURRENCY, max_size=QUEUE_MAX_SIZE)
     demo.launch(debug=True, share=False)
\ No newline at end of file
@@ -22,8 +22,7 @@ system_prompt="""You have to act as a professional doctor, i know you are not bu
 
 
 def process_inputs(audio_filepath, image_filepath):
-    speech_to_text_output = transcribe_with_groq(GROQ_API_KEY=os.environ.get("GROQ_API_KEY"), 
-                                                 audio_filepath=audio_filepath,
+    speech_to_text_output = transcribe_with_groq(audio_filepath=audio_filepath,
                                                  stt_model="whisper-large-v3")
 
     # Handle the image input
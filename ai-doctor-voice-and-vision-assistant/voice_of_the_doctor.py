@@ -43,14 +43,19 @@ def text_to_speech_with_elevenlabs_old(input_text, output_filepath):
 import subprocess
 import platform
 
-def text_to_speech_with_gtts(input_text, output_filepath):
+def text_to_speech_with_gtts(input_text, output_filepath=None, output_fp=None):
     language="en"
 
     audioobj= gTTS(
         text=input_text,
         lang=language,
-        slow=False
+        slow=False,
+        lang_check=False  # "en" is always supported, skip the language table lookup
     )
+    # write into an in-memory buffer instead of a file (no local playback then)
+    if output_fp is not None:
+        audioobj.write_to_fp(output_fp)
+        return
     audioobj.save(output_filepath)
     os_name = platform.system()
     try:
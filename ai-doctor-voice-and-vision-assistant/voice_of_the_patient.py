@@ -1,7 +1,3 @@
-# if you dont use pipenv uncomment the following:
-# from dotenv import load_dotenv
-# load_dotenv()
-
 #Step1: Setup Audio recorder (ffmpeg & portaudio)
 # ffmpeg, portaudio, pyaudio
 import logging
@@ -46,24 +42,46 @@ audio_filepath = "patient_voice_test_for_patient.mp3"
 record_audio(file_path=audio_filepath)   # NOW ENABLED ✅
 
 #Step2: Setup Speech to text – STT – model for transcription
-import os
 from groq import Groq
+from config import CFG
 
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-stt_model = "whisper-large-v3"
+stt_model = CFG.stt_model
+
+def transcribe_with_groq(stt_model, audio_filepath, client=None):
+    # pass an existing client to reuse its open connections
+    if client is None:
+        client = Groq(api_key=CFG.groq_key)
+
+    with open(audio_filepath, "rb") as audio_file:
+        transcription = client.audio.transcriptions.create(
+            model=stt_model,
+            file=audio_file,
+            language="en"
+        )
+    return transcription.text
+
+def transcribe_words_with_groq(stt_model, audio_file, prompt=None, client=None):
+    """
+    Like transcribe_with_groq but returns a list of (word, end time in seconds)
+    so a live transcript can be confirmed and trimmed word by word.
+    audio_file is uploaded as-is, e.g. an in-memory ("audio.wav", wav_bytes) tuple.
+    prompt carries the previous text to keep the wording consistent.
+    """
+    if client is None:
+        client = Groq(api_key=CFG.groq_key)
 
-def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY):
-    client = Groq(api_key=GROQ_API_KEY)
-    
-    audio_file = open(audio_filepath, "rb")
     transcription = client.audio.transcriptions.create(
         model=stt_model,
         file=audio_file,
-        language="en"
+        language="en",
+        prompt=prompt,
+        response_format="verbose_json",
+        timestamp_granularities=["word"]
     )
-    return transcription.text
+    words = getattr(transcription, "words", None) or []
+    return [(w["word"].strip(), w["end"]) for w in words if w["word"].strip()]
 
 # Transcribe the recorded audio and print the text
-transcribed_text = transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY)
+transcribed_text = transcribe_with_groq(stt_model, audio_filepath)
 print("\n=== PATIENT SPEECH TO TEXT ===")
 print(transcribed_text)
\ No newline at end of file